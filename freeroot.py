@@ -10,18 +10,245 @@ import os
 import platform
 import subprocess
 import tempfile
+import urllib.error
 import urllib.request
 import sys
 import shutil
 import stat
 import tarfile
-import io
+import mmap
+import contextlib
+import hashlib
+import json
+import concurrent.futures
+import queue
+import threading
+import shlex
+import uuid
+
+try:
+    import urllib3
+except ImportError:
+    urllib3 = None
+
+try:
+    from IPython.display import clear_output, HTML, display
+    has_ipython = True
+except ImportError:
+    has_ipython = False
+
+# Where FreeRoot() puts the rootfs when no directory is given; None means
+# ~/rootfs. The standalone script points this at the working directory.
+_DEFAULT_ROOTFS_DIR = None
+# Seconds a stalled connection may sit idle before the download is aborted
+_TIMEOUT = 30
+# Read size used when streaming a response body to disk; large reads keep
+# the per-chunk Python overhead small next to the 28MB tarball
+_CHUNK_SIZE = 1 << 20
+# Byte ranges the Ubuntu tarball is split into and fetched in parallel, since
+# a single stream from the mirror is often throttled
+_DOWNLOAD_PARTS = 4
+# Threads writing extracted files; file writes and chmod/utime syscalls
+# release the GIL, so these overlap while the archive is still being read
+_EXTRACT_WORKERS = 4
+# Files a usable rootfs can't be without; if any is gone the missing files are
+# restored from the archive
+_ROOTFS_FILES = ("bin/bash", "etc/os-release")
+# Downloads are kept here so a reinstall after cleanup() only has to unpack
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "freeroot")
+
+# One connection pool shared by every FreeRoot instance, so retries and
+# follow-up downloads reuse an open connection instead of redoing the TLS
+# handshake. Without urllib3 we fall back to one-shot urllib requests.
+if urllib3 is not None:
+    _HTTP = urllib3.PoolManager(
+        maxsize=_DOWNLOAD_PARTS,
+        timeout=_TIMEOUT,
+        retries=urllib3.Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+    )
+else:
+    _HTTP = None
+
+
+@contextlib.contextmanager
+def _open_url(url, method="GET", headers=None):
+    """Open ``url`` and yield a file-like response that streams the body."""
+    if _HTTP is None:
+        request = urllib.request.Request(url, headers=headers or {}, method=method)
+        with urllib.request.urlopen(request, timeout=_TIMEOUT) as response:
+            yield response
+        return
+
+    response = _HTTP.request(method, url, headers=headers, preload_content=False)
+    try:
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        yield response
+    except BaseException:
+        # Don't hand a half-read connection back to the pool
+        response.close()
+        raise
+    else:
+        response.drain_conn()
+        response.release_conn()
+
+
+def _check_member(member, root):
+    """Refuse a tar member that would be written outside ``root``.
+
+    As tarfile's data filter does, this rejects absolute names, ``..``
+    components and names that lead out of ``root`` through a symlink unpacked
+    earlier. Hard link targets get the same name checks.
+    """
+    names = [member.name, member.linkname] if member.islnk() else [member.name]
+    for name in names:
+        if os.path.isabs(name) or ".." in name.split("/"):
+            raise tarfile.TarError(f"Refusing to extract {member.name!r}: {name!r} is outside the rootfs")
+    parent = os.path.realpath(os.path.dirname(os.path.join(root, member.name)))
+    if os.path.commonpath([root, parent]) != root:
+        raise tarfile.TarError(f"Refusing to extract {member.name!r}: it leads to {parent}")
+
+
+def _extract_all(tar, path, keep_existing=False):
+    """Extract every member of ``tar`` into ``path``.
+
+    The archive is read sequentially on the calling thread, which also creates
+    directories, symlinks and other special members so they exist before
+    anything lands beneath them. Regular files are handed to a pool of writer
+    threads. Hard links are made once every file they could point at exists.
+    With ``keep_existing``, members already present under ``path`` are skipped.
+    Members that would land outside ``path`` raise tarfile.TarError.
+    """
+    work = queue.Queue(maxsize=64)
+    errors = []
+
+    def write_files():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            member, data = item
+            target = os.path.join(path, member.name)
+            try:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # When repairing an existing rootfs, replace a symlink rather
+                # than write through it to wherever it points
+                if os.path.islink(target):
+                    os.unlink(target)
+                with open(target, 'wb') as f:
+                    f.write(data)
+                tar.chown(member, target, False)
+                tar.chmod(member, target)
+                tar.utime(member, target)
+            except Exception as e:
+                errors.append(e)
+
+    writers = [threading.Thread(target=write_files, daemon=True) for _ in range(_EXTRACT_WORKERS)]
+    for writer in writers:
+        writer.start()
+
+    root = os.path.realpath(path)
+    directories = []
+    links = []
+    try:
+        for member in tar:
+            # Checked here, before the writers see it, since they open
+            # whatever path they are given
+            _check_member(member, root)
+            if keep_existing and os.path.lexists(os.path.join(path, member.name)):
+                continue
+            if member.isreg():
+                work.put((member, tar.extractfile(member).read()))
+            elif member.islnk():
+                links.append(member)
+            else:
+                if member.isdir():
+                    directories.append(member)
+                tar.extract(member, path, set_attrs=not member.isdir())
+    finally:
+        for _ in writers:
+            work.put(None)
+        for writer in writers:
+            writer.join()
+    if errors:
+        raise errors[0]
+
+    for member in links:
+        target = os.path.join(path, member.name)
+        if os.path.lexists(target):
+            os.unlink(target)
+        tar.extract(member, path)
+
+    # As extractall() does, set directory attributes last and deepest first so
+    # filling a directory doesn't bump its mtime or trip over a read-only mode
+    directories.sort(key=lambda member: member.name, reverse=True)
+    for member in directories:
+        target = os.path.join(path, member.name)
+        tar.chown(member, target, False)
+        tar.utime(member, target)
+        tar.chmod(member, target)
+
+
+def _fast_rmtree(path):
+    """Delete ``path`` and everything below it.
+
+    Unlike shutil.rmtree this trusts the entry type scandir already read from
+    the directory listing rather than stat-ing every entry again, which adds
+    up over the tens of thousands of files in a used rootfs.
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                _fast_rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+    os.rmdir(path)
+
+
+class _HashingReader:
+    """File-like wrapper that hashes everything read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+
+def _sha256_file(path, digest=None):
+    """Return the sha256 of the file at ``path``, continuing ``digest`` if given."""
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def _copy_file(src, dst):
+    """Copy ``src`` to ``dst`` with sendfile(), so the data never enters Python."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+
+def _cache_path(url):
+    """Return the download cache location for ``url``."""
+    return os.path.join(_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest())
 
 
 class FreeRoot:
-    def __init__(self, rootfs_dir=None):
+    def __init__(self, rootfs_dir=None, use_cache=True):
         self.user_home = os.path.expanduser("~")
-        self.rootfs_dir = rootfs_dir or os.path.join(self.user_home, "rootfs")
+        self.rootfs_dir = rootfs_dir or _DEFAULT_ROOTFS_DIR or os.path.join(self.user_home, "rootfs")
+        self.use_cache = use_cache
         
         self.arch = platform.machine()
         if self.arch == "x86_64":
@@ -36,110 +263,433 @@ class FreeRoot:
         self.proot_path = os.path.join(self.rootfs_dir, "usr", "local", "bin", "proot")
         self.installed_flag = os.path.join(self.rootfs_dir, ".installed")
 
-    def _download_file(self, url, target_path=None, return_data=False, max_retries=3):
+        # proot arguments shared by every launch; only the working directory
+        # and the command differ between calls. /etc/resolv.conf needs no bind:
+        # _configure_rootfs() writes it into the rootfs, where the guest sees it.
+        self._proot_prefix = (
+            self.proot_path,
+            f"--rootfs={self.rootfs_dir}",
+            "-0",
+            "-b", "/dev",
+            "-b", "/sys",
+            "-b", "/proc",
+            "--kill-on-exit",
+        )
+
+        # Long-lived proot bash that run_command() feeds commands to, so each
+        # call skips proot's startup and ptrace setup
+        self._shell = None
+        self._shell_stderr = None
+        self._shell_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _download_ranges(self, url, path, parts):
+        # Returns False if the server doesn't advertise byte-range support
+        with _open_url(url, method="HEAD") as response:
+            total = response.headers.get("Content-Length")
+            accepts_ranges = response.headers.get("Accept-Ranges") == "bytes"
+        if total is None or not accepts_ranges:
+            return False
+        total = int(total)
+        if total < parts * _CHUNK_SIZE:
+            return False
+
+        def fetch(start, end):
+            with _open_url(url, headers={"Range": f"bytes={start}-{end}"}) as response:
+                if response.status != 206:
+                    raise RuntimeError("Server ignored the Range request")
+                offset = start
+                while True:
+                    chunk = response.read(_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            if offset != end + 1:
+                raise RuntimeError(f"Received {offset - start} of {end - start + 1} bytes")
+
+        print(f"Downloading {url} in {parts} parts")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, total)
+            except OSError:
+                os.ftruncate(fd, total)
+            bounds = [(i * total // parts, (i + 1) * total // parts - 1) for i in range(parts)]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=parts) as pool:
+                for future in [pool.submit(fetch, start, end) for start, end in bounds]:
+                    future.result()
+        finally:
+            os.close(fd)
+        if os.path.getsize(path) != total:
+            raise RuntimeError(f"Expected {total} bytes, got {os.path.getsize(path)}")
+        return True
+
+    def _download_file(self, url, target_path, max_retries=3, parts=1):
+        # Returns the sha256 hex digest of the downloaded file, or None on failure
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        part_path = target_path + ".part"
+        # The ranged download fills a preallocated file out of order, so it
+        # gets its own name and is never taken for a resumable .part
+        ranges_path = target_path + ".ranges"
+        if parts > 1 and not os.path.exists(part_path):
+            try:
+                if self._download_ranges(url, ranges_path, parts):
+                    # Parts arrive out of order, so hash the assembled file
+                    digest = _sha256_file(ranges_path)
+                    os.replace(ranges_path, target_path)
+                    return digest.hexdigest()
+            except Exception as e:
+                print(f"Parallel download failed, falling back to a single stream: {e}")
+            finally:
+                if os.path.exists(ranges_path):
+                    os.remove(ranges_path)
         for i in range(max_retries):
             try:
-                print(f"Downloading {url}")
-                if return_data:
-                    with urllib.request.urlopen(url) as response:
-                        return response.read()
-                else:
-                    if target_path:
-                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                        urllib.request.urlretrieve(url, target_path)
-                        return True
+                # Pick up where an interrupted attempt left off
+                offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                headers = {"Range": f"bytes={offset}-"} if offset else None
+                print(f"Downloading {url}" + (f" from byte {offset}" if offset else ""))
+                with _open_url(url, headers=headers) as response:
+                    # A 200 means the server ignored the Range and sent it all again
+                    mode = 'ab' if offset and response.status == 206 else 'wb'
+                    expected = response.headers.get("Content-Length")
+                    # Hash while writing; a resumed download first takes in
+                    # the bytes it already has
+                    digest = _sha256_file(part_path) if mode == 'ab' else hashlib.sha256()
+                    with open(part_path, mode) as f:
+                        start = f.tell()
+                        for chunk in iter(lambda: response.read(_CHUNK_SIZE), b""):
+                            f.write(chunk)
+                            digest.update(chunk)
+                        received = f.tell() - start
+                # urllib hands back a short body without complaint when the
+                # connection drops, so check the length before trusting it
+                if expected is not None and received != int(expected):
+                    raise RuntimeError(f"Received {received} of {expected} bytes")
+                # Only complete downloads ever appear under the final name
+                os.replace(part_path, target_path)
+                return digest.hexdigest()
+            except urllib.error.HTTPError as e:
+                print(f"Attempt {i+1} failed: {e}")
+                if e.code == 416:
+                    # The leftover part doesn't fit the remote file; start over
+                    os.remove(part_path)
             except Exception as e:
                 print(f"Attempt {i+1} failed: {e}")
-        return False if not return_data else None
+        return None
+
+    def _fetch_cached(self, url, parts=1):
+        # Returns (path, sha256 hex digest), or None if the download failed
+        path = _cache_path(url)
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            print(f"Using cached {url}")
+            return path, _sha256_file(path).hexdigest()
+        digest = self._download_file(url, path, parts=parts)
+        return (path, digest) if digest else None
 
     def _setup_proot(self):
-        data = self._download_file(self.proot_url, return_data=True)
-        if not data:
-            raise RuntimeError("Failed to download PRoot")
-            
-        os.makedirs(os.path.dirname(self.proot_path), exist_ok=True)
-        with open(self.proot_path, 'wb') as f:
-            f.write(data)
+        # Returns the sha256 of the installed binary
+        if self.use_cache:
+            cached = self._fetch_cached(self.proot_url)
+            if not cached:
+                raise RuntimeError("Failed to download PRoot")
+            path, digest = cached
+            os.makedirs(os.path.dirname(self.proot_path), exist_ok=True)
+            _copy_file(path, self.proot_path)
+        else:
+            digest = self._download_file(self.proot_url, self.proot_path)
+            if not digest:
+                raise RuntimeError("Failed to download PRoot")
         os.chmod(self.proot_path, os.stat(self.proot_path).st_mode | stat.S_IEXEC)
+        return digest
 
-    def _extract_rootfs(self):
-        data = self._download_file(self.ubuntu_url, return_data=True)
-        if not data:
-            raise RuntimeError("Failed to download Ubuntu")
-            
+    def _fetch_rootfs(self, keep_existing=False, max_retries=3):
+        # Returns the tarball's path on disk and its sha256. Without the cache
+        # the archive is extracted while it downloads and the path is None, as
+        # there is nothing left to unpack.
+        if self.use_cache:
+            cached = self._fetch_cached(self.ubuntu_url, parts=_DOWNLOAD_PARTS)
+            if not cached:
+                raise RuntimeError("Failed to download Ubuntu")
+            return cached
+
+        os.makedirs(self.rootfs_dir, exist_ok=True)
+        for i in range(max_retries):
+            try:
+                print(f"Downloading {self.ubuntu_url}")
+                print(f"Extracting Ubuntu rootfs to {self.rootfs_dir}")
+                # Stream the response through gzip straight into tarfile ('r|gz'
+                # never seeks), so download, decompression and extraction overlap
+                # instead of buffering the whole archive in memory first.
+                with _open_url(self.ubuntu_url) as response:
+                    reader = _HashingReader(response)
+                    with tarfile.open(fileobj=reader, mode='r|gz') as tar:
+                        _extract_all(tar, self.rootfs_dir, keep_existing)
+                    # tarfile stops at the end-of-archive marker; hash the rest
+                    while reader.read(_CHUNK_SIZE):
+                        pass
+                return None, reader.sha256.hexdigest()
+            except Exception as e:
+                print(f"Attempt {i+1} failed: {e}")
+        raise RuntimeError("Failed to download Ubuntu")
+
+    def _extract_rootfs(self, tarball, keep_existing=False):
         print(f"Extracting Ubuntu rootfs to {self.rootfs_dir}")
         os.makedirs(self.rootfs_dir, exist_ok=True)
-        
-        # Use Python's tarfile instead of system tar command
-        tar_data = io.BytesIO(data)
-        with tarfile.open(fileobj=tar_data, mode='r:gz') as tar:
-            tar.extractall(path=self.rootfs_dir)
+        # Map the archive rather than read() it, so gzip pulls pages straight
+        # from the page cache without an extra copy into Python memory
+        with open(tarball, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with tarfile.open(fileobj=mm, mode='r:gz') as tar:
+                _extract_all(tar, self.rootfs_dir, keep_existing)
 
-    def _configure_rootfs(self):
+    def _configure_rootfs(self, keep_existing=False):
         # Configure /etc/resolv.conf to enable networking
         resolv_conf = os.path.join(self.rootfs_dir, "etc", "resolv.conf")
+        if keep_existing and os.path.lexists(resolv_conf):
+            return
         os.makedirs(os.path.dirname(resolv_conf), exist_ok=True)
         try:
+            # Replace a symlink (e.g. to systemd's stub resolver) with a plain
+            # file rather than write through it to a path that isn't there
+            if os.path.islink(resolv_conf):
+                os.unlink(resolv_conf)
             with open(resolv_conf, "w") as f:
                 f.write("nameserver 8.8.8.8\nnameserver 1.1.1.1\n")
         except Exception as e:
             print(f"Warning: Could not configure resolv.conf: {e}")
 
+    def _write_manifest(self, manifest):
+        with open(self.installed_flag, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    def _read_manifest(self):
+        try:
+            with open(self.installed_flag) as f:
+                text = f.read()
+        except OSError:
+            return {}
+        try:
+            manifest = json.loads(text)
+        except ValueError:
+            manifest = None
+        if isinstance(manifest, dict):
+            return manifest
+
+        # A plain flag from before the manifest existed: keep the installed
+        # rootfs and record what is on disk, instead of reinstalling over it
+        manifest = {"proot_url": self.proot_url, "ubuntu_url": self.ubuntu_url}
+        if os.path.isfile(self.proot_path):
+            manifest["proot_sha256"] = _sha256_file(self.proot_path).hexdigest()
+        self._write_manifest(manifest)
+        return manifest
+
     def install(self):
-        if os.path.exists(self.installed_flag):
+        # The installed flag is a manifest of what was installed from where;
+        # rootfs_sha256 records which archive the rootfs was unpacked from.
+        # Only redo the steps whose result is missing or no longer matches it.
+        manifest = self._read_manifest()
+        if manifest.get("proot_url") != self.proot_url:
+            manifest.pop("proot_sha256", None)
+        # The same Ubuntu that is already installed is only repaired: files
+        # still in the rootfs are kept, so changes made since (dpkg state,
+        # users, ...) survive. A different Ubuntu, or none, is unpacked in full.
+        repair = manifest.get("ubuntu_url") == self.ubuntu_url
+        need_proot = not (
+            os.path.isfile(self.proot_path)
+            and manifest.get("proot_sha256") == _sha256_file(self.proot_path).hexdigest()
+        )
+        need_rootfs = not (
+            repair
+            and all(os.path.lexists(os.path.join(self.rootfs_dir, p)) for p in _ROOTFS_FILES)
+        )
+        if not need_proot and not need_rootfs:
             print("FreeRoot is already installed.")
             return
         
-        self._setup_proot()
-        self._extract_rootfs()
-        self._configure_rootfs()
-        
-        # Create installed flag file
-        with open(self.installed_flag, 'w') as f:
-            f.write('installed')
-        print("FreeRoot installation complete.")
+        # A rootfs this call creates is removed again if the install fails, so
+        # a half-unpacked Ubuntu isn't left behind. An existing one is kept.
+        fresh = not os.path.exists(self.rootfs_dir)
+        try:
+            # PRoot and Ubuntu come from different hosts and both downloads are
+            # network-bound, so fetch them side by side and unpack once both are in
+            tarball = None
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+                proot = pool.submit(self._setup_proot) if need_proot else None
+                rootfs = pool.submit(self._fetch_rootfs, repair) if need_rootfs else None
+                if rootfs:
+                    tarball, manifest["rootfs_sha256"] = rootfs.result()
+                if proot:
+                    manifest["proot_sha256"] = proot.result()
+            if tarball:
+                self._extract_rootfs(tarball, repair)
+            if need_rootfs:
+                self._configure_rootfs(repair)
+            
+            # Write the installed flag last so an interrupted install is retried
+            manifest["proot_url"] = self.proot_url
+            manifest["ubuntu_url"] = self.ubuntu_url
+            self._write_manifest(manifest)
+        except Exception as e:
+            print(f"Installation failed: {e}")
+            if fresh and os.path.exists(self.rootfs_dir):
+                print(f"Cleaning up {self.rootfs_dir}")
+                shutil.rmtree(self.rootfs_dir, ignore_errors=True)
+            raise
+
+        if has_ipython:
+            clear_output(wait=True)
+            display(HTML("""
+            <div style="background-color: #f0f0f0; padding: 20px; border-radius: 10px; text-align: center;">
+              <h3 style="color: #2c3e50;">✅ FreeRoot Python Installation Complete!</h3>
+              <p>Ubuntu environment is ready to use</p>
+            </div>
+            """))
+        else:
+            print("FreeRoot installation complete.")
 
-    def run_command(self, command, working_dir=None, env=None):
+    def run_command(self, command, working_dir=None, env=None, capture=True):
         if not os.path.exists(self.installed_flag):
             self.install()
+
+        # A list is an argv run as-is, as with subprocess; quoting it for bash
+        # lets it take the same paths as a command string
+        if not isinstance(command, str):
+            command = " ".join(shlex.quote(arg) for arg in command)
+
+        # A custom env needs a fresh process; everything else that is captured
+        # goes through the persistent shell
+        if capture and env is None:
+            return self._run_in_shell(command, working_dir or "/root")
             
-        full_cmd = [
-            self.proot_path,
-            f"--rootfs={self.rootfs_dir}",
-            "-0",
-            "-w", working_dir or "/root",
-            "-b", "/dev",
-            "-b", "/sys",
-            "-b", "/proc",
-            "-b", f"{self.rootfs_dir}/etc/resolv.conf:/etc/resolv.conf",
-            "--kill-on-exit",
-            "bash", "-c", command
-        ]
+        full_cmd = [*self._proot_prefix, "-w", working_dir or "/root", "bash", "-c", command]
         
         environ = os.environ.copy()
         if env:
             environ.update(env)
         
-        try:
-            result = subprocess.run(
-                full_cmd,
-                env=environ,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True
+        # Python opens its own fds non-inheritable (PEP 446), so close_fds buys
+        # nothing here. Leaving it off skips closing every possible fd in the
+        # child and lets subprocess use posix_spawn, which doesn't copy the
+        # page tables of a large notebook kernel the way fork() does.
+        if not capture:
+            # The command writes straight to our stdout/stderr, so nothing it
+            # prints is buffered here
+            try:
+                subprocess.run(full_cmd, env=environ, close_fds=False, check=True)
+            except subprocess.CalledProcessError as e:
+                print(f"Command failed with exit code {e.returncode}")
+                raise
+            return None
+
+        # Spool output to temporary files rather than pipes so chatty commands
+        # like apt-get don't pile up in memory while they run
+        with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+            try:
+                subprocess.run(full_cmd, env=environ, stdout=out, stderr=err, close_fds=False, check=True)
+            except subprocess.CalledProcessError as e:
+                out.seek(0)
+                err.seek(0)
+                e.stdout = out.read().decode(errors="replace")
+                e.stderr = err.read().decode(errors="replace")
+                print(f"Command failed with exit code {e.returncode}")
+                print(f"Error output: {e.stderr}")
+                raise
+            out.seek(0)
+            return out.read().decode(errors="replace")
+
+    def _start_persistent_shell(self):
+        cmd = [*self._proot_prefix, "-w", "/root", "bash"]
+
+        # The shell only sees the environment it was started with, so remember
+        # it and start a new shell once os.environ has changed
+        self._shell_environ = os.environ.copy()
+        # The shell's stderr shares this file's offset, so rewinding it before
+        # each command leaves exactly that command's errors in it
+        self._shell_stderr = tempfile.TemporaryFile()
+        self._shell = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self._shell_stderr,
+            env=self._shell_environ,
+            close_fds=False
+        )
+
+    def _run_in_shell(self, command, working_dir):
+        with self._shell_lock:
+            if (self._shell is None or self._shell.poll() is not None
+                    or self._shell_environ != os.environ):
+                self.close()
+                self._start_persistent_shell()
+
+            # Run in a subshell so `cd`, `exit` and variables don't leak into
+            # later commands, then print a marker carrying the exit status. The
+            # leading newline guarantees the marker starts a line of its own.
+            # With job control on the subshell gets a process group of its own,
+            # and killing that group once it exits takes any background jobs
+            # with it, so their late output can't end up in the next command.
+            marker = f"__FREEROOT_{uuid.uuid4().hex}__"
+            script = (
+                "set -m\n"
+                f"( cd {shlex.quote(working_dir)} && eval {shlex.quote(command)} ) </dev/null &\n"
+                "wait $!; __freeroot_status=$?\n"
+                "kill -KILL -- -$! 2>/dev/null\n"
+                f"printf '\\n%s %d\\n' {marker} $__freeroot_status\n"
             )
-            return result.stdout
-        except subprocess.CalledProcessError as e:
-            print(f"Command failed with exit code {e.returncode}")
-            print(f"Error output: {e.stderr}")
-            raise
+            self._shell_stderr.seek(0)
+            self._shell_stderr.truncate()
+            marker = marker.encode()
+            # Spool output to a temporary file as it arrives, like the one-shot
+            # path, rather than collecting it in memory
+            out = tempfile.TemporaryFile()
+            try:
+                self._shell.stdin.write(script.encode())
+                self._shell.stdin.flush()
+                while True:
+                    line = self._shell.stdout.readline()
+                    if not line:
+                        raise RuntimeError("The PRoot shell exited unexpectedly")
+                    if line.startswith(marker):
+                        returncode = int(line.split()[1])
+                        break
+                    out.write(line)
+            except BaseException:
+                out.close()
+                # Interrupted or broken mid-command: the shell's output is no
+                # longer in step with our reads, so kill it (and the command,
+                # via --kill-on-exit) and let the next call start a fresh one
+                self._shell.kill()
+                self.close()
+                raise
+            with out:
+                # Drop the newline printed ahead of the marker
+                out.truncate(max(out.tell() - 1, 0))
+                out.seek(0)
+                output = out.read().decode(errors="replace")
+
+            self._shell_stderr.seek(0)
+            errors = self._shell_stderr.read().decode(errors="replace")
+
+        if returncode != 0:
+            print(f"Command failed with exit code {returncode}")
+            print(f"Error output: {errors}")
+            raise subprocess.CalledProcessError(returncode, command, output, errors)
+        return output
 
     def clone_repo(self, repo_url, target_dir=None, branch=None):
         if target_dir is None:
             repo_name = repo_url.split("/")[-1].replace(".git", "")
             target_dir = repo_name
         
+        # Ubuntu base doesn't ship git
+        self.run_command("which git >/dev/null 2>&1 || (apt-get update && apt-get install -y git)")
+        
         cmd = f"git clone {repo_url}"
         if branch:
             cmd += f" --branch {branch}"
@@ -151,37 +701,49 @@ class FreeRoot:
         if not os.path.exists(self.installed_flag):
             self.install()
         
-        cmd = [
-            self.proot_path,
-            f"--rootfs={self.rootfs_dir}",
-            "-0",
-            "-w", "/root",
-            "-b", "/dev",
-            "-b", "/sys",
-            "-b", "/proc",
-            "-b", f"{self.rootfs_dir}/etc/resolv.conf:/etc/resolv.conf",
-            "--kill-on-exit",
-            "bash"
-        ]
+        cmd = [*self._proot_prefix, "-w", "/root", "bash"]
         
-        subprocess.run(cmd)
+        # See run_command() for why close_fds is off
+        subprocess.run(cmd, close_fds=False)
+
+    def close(self):
+        if self._shell is not None:
+            # bash exits once its input is closed; --kill-on-exit takes down
+            # anything it left running
+            try:
+                self._shell.stdin.close()
+                self._shell.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self._shell.kill()
+                self._shell.wait()
+            self._shell = None
+        if self._shell_stderr is not None:
+            self._shell_stderr.close()
+            self._shell_stderr = None
 
     def cleanup(self):
+        self.close()
         if os.path.exists(self.rootfs_dir):
-            shutil.rmtree(self.rootfs_dir)
+            _fast_rmtree(self.rootfs_dir)
             print(f"Cleaned up {self.rootfs_dir}")
 
+    def clear_cache(self):
+        if os.path.exists(_CACHE_DIR):
+            shutil.rmtree(_CACHE_DIR)
+            print(f"Cleared download cache {_CACHE_DIR}")
+
 
-def setup_ubuntu(rootfs_dir=None):
+def setup_ubuntu(rootfs_dir=None, use_cache=True):
     """
     Set up a FreeRoot instance with Ubuntu.
     
     Args:
         rootfs_dir: Custom directory for the root filesystem
+        use_cache: Keep downloads in ~/.cache/freeroot for faster reinstalls
         
     Returns:
         FreeRoot: A configured FreeRoot instance
     """
-    fr = FreeRoot(rootfs_dir)
+    fr = FreeRoot(rootfs_dir, use_cache)
     fr.install()
     return fr
\ No newline at end of file
@@ -1,4 +1,72 @@
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Command
+
+
+def _splice(path, begin_marker, end_marker, body):
+    """Replace the text between two marker lines in ``path`` with ``body``."""
+    with open(path) as f:
+        text = f.read()
+    start = text.index(begin_marker) + len(begin_marker)
+    end = text.index(end_marker)
+    with open(path, "w") as f:
+        f.write(text[:start] + body + text[end:])
+
+
+def _module_body(path):
+    """Return a module's source from its imports on.
+
+    The shebang and usage docstring only make sense at the top of the file
+    they came from.
+    """
+    with open(path) as f:
+        source = f.read()
+    return source[source.index("\nimport ") + 1:].rstrip("\n") + "\n"
+
+
+class BuildDirect(Command):
+    """Generate the single-file scripts from freeroot.py."""
+
+    description = "generate direct_use_freeroot.py and standalone_freeroot.py from freeroot.py"
+    user_options = []
+
+    scripts = ["direct_use_freeroot.py", "standalone_freeroot.py"]
+    begin_marker = "# --- BEGIN generated from freeroot.py ---\n"
+    end_marker = "# --- END generated from freeroot.py ---\n"
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        body = _module_body("freeroot.py")
+        for script in self.scripts:
+            _splice(script, self.begin_marker, self.end_marker, body)
+            print(f"Generated {script} from freeroot.py")
+
+
+class BuildInstaller(Command):
+    """Bundle the FreeRoot code into one_line_installer.py."""
+
+    description = "bundle the FreeRoot code into one_line_installer.py"
+    user_options = []
+
+    begin_marker = "# --- BEGIN bundled freeroot.py ---\n"
+    end_marker = "# --- END bundled freeroot.py ---\n"
+
+    def initialize_options(self):
+        pass
+
+    def finalize_options(self):
+        pass
+
+    def run(self):
+        self.run_command("build_direct")
+        # Only the module body: the installer creates its own FreeRoot inside
+        # install(), where a failure falls through to the pip method
+        _splice("one_line_installer.py", self.begin_marker, self.end_marker, _module_body("freeroot.py"))
+        print("Bundled freeroot.py into one_line_installer.py")
+
 
 setup(
     name="freeroot",
@@ -9,6 +77,7 @@ setup(
     author="Based on foxytouxxx/freeroot",
     url="https://github.com/malc3om/free-root-python",
     py_modules=["freeroot"],
+    cmdclass={"build_direct": BuildDirect, "build_installer": BuildInstaller},
     python_requires=">=3.6",
     install_requires=[],
     classifiers=[